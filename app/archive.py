@@ -0,0 +1,260 @@
+import os
+import time
+import zlib
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Streams ZIP archives of files that are already on disk without building
+# them in memory or in a temp file. Every entry is stored (no compression):
+# photos are already compressed, and stored entries let us compute the exact
+# size and byte layout of the archive before reading a single file, which is
+# what makes Content-Length and Range requests possible.
+#
+# CRC-32s go in a data descriptor after each entry, so the headers never
+# depend on file contents and the archive bytes are the same on every request.
+
+READ_BLOCK_SIZE = 256 * 1024
+
+ZIP64_LIMIT = 0xFFFFFFFF
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+
+_crc_cache = OrderedDict()
+_crc_cache_lock = threading.Lock()
+CRC_CACHE_SIZE = 4096
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    return dos_time, date
+
+
+def file_crc32(path, size, mtime_ns):
+    """CRC-32 of a file, cached by (path, size, mtime) for resumed downloads."""
+    key = (path, size, mtime_ns)
+    with _crc_cache_lock:
+        if key in _crc_cache:
+            _crc_cache.move_to_end(key)
+            return _crc_cache[key]
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+    _remember_crc(key, crc)
+    return crc
+
+
+def _remember_crc(key, crc):
+    with _crc_cache_lock:
+        _crc_cache[key] = crc
+        _crc_cache.move_to_end(key)
+        while len(_crc_cache) > CRC_CACHE_SIZE:
+            _crc_cache.popitem(last=False)
+
+
+class ZipEntry:
+    def __init__(self, arcname, path):
+        stat = os.stat(path)
+        self.arcname = arcname
+        self.name_bytes = arcname.encode('utf-8')
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.mtime_ns = stat.st_mtime_ns
+        self.zip64 = self.size >= ZIP64_LIMIT
+        self.offset = 0
+
+    @property
+    def crc_key(self):
+        return (self.path, self.size, self.mtime_ns)
+
+    def crc32(self):
+        return file_crc32(self.path, self.size, self.mtime_ns)
+
+    def local_header(self):
+        dos_time, dos_date = _dos_datetime(self.mtime)
+        if self.zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, self.size, self.size)
+            size32 = ZIP64_LIMIT
+        else:
+            extra = b''
+            size32 = self.size
+        return struct.pack(
+            '<IHHHHHIIIHH', 0x04034b50,
+            VERSION_ZIP64 if self.zip64 else VERSION_DEFAULT,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8, 0, dos_time, dos_date,
+            0, size32, size32, len(self.name_bytes), len(extra),
+        ) + self.name_bytes + extra
+
+    def data_descriptor(self, crc):
+        if self.zip64:
+            return struct.pack('<IIQQ', 0x08074b50, crc, self.size, self.size)
+        return struct.pack('<IIII', 0x08074b50, crc, self.size, self.size)
+
+    def data_descriptor_length(self):
+        return 24 if self.zip64 else 16
+
+    def central_header(self, crc):
+        dos_time, dos_date = _dos_datetime(self.mtime)
+        extra_fields = []
+        size32 = self.size
+        offset32 = self.offset
+        if self.zip64:
+            extra_fields += [self.size, self.size]
+            size32 = ZIP64_LIMIT
+        if self.offset >= ZIP64_LIMIT:
+            extra_fields.append(self.offset)
+            offset32 = ZIP64_LIMIT
+        extra = b''
+        if extra_fields:
+            extra = struct.pack('<HH', 0x0001, 8 * len(extra_fields)) + \
+                struct.pack('<%dQ' % len(extra_fields), *extra_fields)
+        version = VERSION_ZIP64 if extra_fields else VERSION_DEFAULT
+        return struct.pack(
+            '<IHHHHHHIIIHHHHHII', 0x02014b50, version, version,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8, 0, dos_time, dos_date,
+            crc, size32, size32, len(self.name_bytes), len(extra), 0, 0, 0, 0, offset32,
+        ) + self.name_bytes + extra
+
+    def central_header_length(self):
+        extra_count = (2 if self.zip64 else 0) + (1 if self.offset >= ZIP64_LIMIT else 0)
+        extra_length = 4 + 8 * extra_count if extra_count else 0
+        return 46 + len(self.name_bytes) + extra_length
+
+
+class ZipStream:
+    """A deterministic stored ZIP of ``(arcname, path)`` pairs.
+
+    ``size`` and ``etag`` are available up front; ``iter_bytes(start, stop)``
+    yields any byte range of the archive, reading at most one block at a time.
+    """
+
+    def __init__(self, files):
+        self.entries = []
+        seen = set()
+        for arcname, path in files:
+            arcname = _unique_arcname(arcname, seen)
+            self.entries.append(ZipEntry(arcname, path))
+
+        # (start, length, kind, entry) for each piece of the archive
+        self.segments = []
+        offset = 0
+        for entry in self.entries:
+            entry.offset = offset
+            header_length = len(entry.local_header())
+            self.segments.append((offset, header_length, 'local_header', entry))
+            offset += header_length
+            self.segments.append((offset, entry.size, 'data', entry))
+            offset += entry.size
+            self.segments.append((offset, entry.data_descriptor_length(), 'data_descriptor', entry))
+            offset += entry.data_descriptor_length()
+
+        self.central_directory_offset = offset
+        self.central_directory_size = sum(e.central_header_length() for e in self.entries)
+        for entry in self.entries:
+            self.segments.append((offset, entry.central_header_length(), 'central_header', entry))
+            offset += entry.central_header_length()
+        end_record = self._end_records()
+        self.segments.append((offset, len(end_record), 'end', None))
+        self.size = offset + len(end_record)
+
+    @property
+    def etag(self):
+        digest = hashlib.sha1()
+        for entry in self.entries:
+            digest.update(f"{entry.arcname}\0{entry.size}\0{entry.mtime_ns}\0".encode('utf-8'))
+        return digest.hexdigest()
+
+    @property
+    def last_modified(self):
+        return max((entry.mtime for entry in self.entries), default=None)
+
+    def _end_records(self):
+        count = len(self.entries)
+        cd_offset = self.central_directory_offset
+        cd_size = self.central_directory_size
+        records = b''
+        if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            zip64_end_offset = cd_offset + cd_size
+            records += struct.pack(
+                '<IQHHIIQQQQ', 0x06064b50, 44, VERSION_ZIP64, VERSION_ZIP64,
+                0, 0, count, count, cd_size, cd_offset,
+            )
+            records += struct.pack('<IIQI', 0x07064b50, 0, zip64_end_offset, 1)
+        records += struct.pack(
+            '<IHHHHIIH', 0x06054b50, 0, 0,
+            min(count, 0xFFFF), min(count, 0xFFFF),
+            min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0,
+        )
+        return records
+
+    def iter_bytes(self, start=0, stop=None):
+        if stop is None:
+            stop = self.size
+        # CRCs computed while streaming entry data in this request
+        crcs = {}
+        for seg_start, seg_length, kind, entry in self.segments:
+            seg_stop = seg_start + seg_length
+            if seg_stop <= start:
+                continue
+            if seg_start >= stop:
+                break
+            lo = max(start, seg_start) - seg_start
+            hi = min(stop, seg_stop) - seg_start
+
+            if kind == 'data':
+                crc = yield from self._iter_file(entry, lo, hi)
+                if crc is not None:
+                    crcs[entry] = crc
+                continue
+
+            if kind == 'local_header':
+                data = entry.local_header()
+            elif kind == 'data_descriptor':
+                data = entry.data_descriptor(crcs[entry] if entry in crcs else entry.crc32())
+            elif kind == 'central_header':
+                data = entry.central_header(crcs[entry] if entry in crcs else entry.crc32())
+            else:
+                data = self._end_records()
+            yield data[lo:hi]
+
+    def _iter_file(self, entry, lo, hi):
+        # Only a read of the whole file gives us its CRC for free
+        whole = lo == 0 and hi == entry.size
+        crc = 0
+        with open(entry.path, 'rb') as f:
+            f.seek(lo)
+            remaining = hi - lo
+            while remaining > 0:
+                block = f.read(min(READ_BLOCK_SIZE, remaining))
+                if not block:
+                    raise IOError(f"{entry.path} shrank while being archived")
+                if whole:
+                    crc = zlib.crc32(block, crc)
+                remaining -= len(block)
+                yield block
+        if whole:
+            _remember_crc(entry.crc_key, crc)
+            return crc
+        return None
+
+
+def _unique_arcname(arcname, seen):
+    candidate = arcname
+    stem, ext = os.path.splitext(arcname)
+    n = 1
+    while candidate in seen:
+        candidate = f"{stem}_{n}{ext}"
+        n += 1
+    seen.add(candidate)
+    return candidate
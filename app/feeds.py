@@ -0,0 +1,238 @@
+import os
+import glob
+import time
+from email.utils import format_datetime
+from datetime import datetime, timezone
+from xml.etree import ElementTree as ET
+from flask import send_file, url_for
+from sqlalchemy import event
+from app import app, db
+from app.models import Post, Photo
+
+# Atom/RSS feeds and the sitemap are rendered to files under FEED_CACHE_FOLDER
+# and served from there. Any committed change to a Post or Photo bumps a
+# version stamp on disk; a cached file is only used if it was rendered for
+# the current version, so every gunicorn worker sees the invalidation.
+
+FEED_MAX_ITEMS = 50
+# Google reads at most 1000 image entries per sitemap <url>
+SITEMAP_MAX_IMAGES = 1000
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+IMAGE_NS = 'http://www.google.com/schemas/sitemap-image/1.1'
+
+
+def _version_path():
+    return os.path.join(app.config['FEED_CACHE_FOLDER'], 'version')
+
+
+def current_version():
+    try:
+        with open(_version_path()) as f:
+            return f.read().strip() or '0'
+    except FileNotFoundError:
+        return '0'
+
+
+def invalidate_feeds():
+    folder = app.config['FEED_CACHE_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    path = _version_path()
+    with open(path + '.tmp', 'w') as f:
+        f.write(str(time.time_ns()))
+    os.replace(path + '.tmp', path)
+
+
+@event.listens_for(db.session, 'before_flush')
+def _touch_changed_posts(session, flush_context, instances):
+    # Adding, editing or removing a photo counts as an edit of its post.
+    # New posts are left alone; until edited they fall back to their timestamp.
+    now = datetime.utcnow()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        post = obj if isinstance(obj, Post) else obj.post if isinstance(obj, Photo) else None
+        if post is not None and post not in session.new and post not in session.deleted:
+            post.updated = now
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_feed_changes(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Post, Photo)):
+            session.info['feeds_stale'] = True
+            return
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('feeds_stale', False):
+        invalidate_feeds()
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_after_rollback(session):
+    session.info.pop('feeds_stale', None)
+
+
+def _isoformat(dt):
+    return dt.replace(tzinfo=timezone.utc).isoformat()
+
+
+def _absolute_url(path):
+    # Rendered files are shared by every client, so links come from SITE_URL
+    # rather than the Host header of whichever request rendered them
+    return app.config['SITE_URL'] + path
+
+
+def _home_url():
+    # url_for('index') resolves to /index, the second rule on that view
+    return _absolute_url('/')
+
+
+def _post_url(post):
+    return _home_url() + f"#post-{post.id}"
+
+
+def _photo_url(photo):
+    return _absolute_url(url_for('uploaded_file', filename=photo.image_filename))
+
+
+def _photo_caption(photo):
+    camera = ' '.join(filter(None, [photo.camera_make, photo.camera_model]))
+    settings = ' '.join(filter(None, [photo.focal_length, photo.aperture, photo.shutter_speed,
+                                      f"ISO {photo.iso}" if photo.iso else None]))
+    return ' · '.join(filter(None, [photo.location, camera, photo.lens, settings]))
+
+
+def _post_html(post):
+    parts = []
+    for photo in post.photos.order_by(Photo.id):
+        if photo.image_filename:
+            img = ET.Element('img', src=_photo_url(photo), alt=_photo_caption(photo) or post.title or '')
+            parts.append(ET.tostring(img, encoding='unicode', method='html'))
+    if post.body:
+        p = ET.Element('p')
+        p.text = post.body
+        parts.append(ET.tostring(p, encoding='unicode', method='html'))
+    return '\n'.join(parts)
+
+
+def _recent_posts():
+    return Post.query.order_by(Post.timestamp.desc()).limit(FEED_MAX_ITEMS).all()
+
+
+def render_atom():
+    posts = _recent_posts()
+    feed = ET.Element('feed', xmlns=ATOM_NS)
+    ET.SubElement(feed, 'title').text = 'Photography Blog'
+    ET.SubElement(feed, 'id').text = _home_url()
+    ET.SubElement(feed, 'link', href=_home_url())
+    ET.SubElement(feed, 'link', rel='self', href=_absolute_url(url_for('atom_feed')))
+    updated = max((p.updated or p.timestamp for p in posts if p.updated or p.timestamp), default=None)
+    ET.SubElement(feed, 'updated').text = _isoformat(updated) if updated else '1970-01-01T00:00:00+00:00'
+    for post in posts:
+        entry = ET.SubElement(feed, 'entry')
+        ET.SubElement(entry, 'title').text = post.title or ''
+        ET.SubElement(entry, 'id').text = _post_url(post)
+        ET.SubElement(entry, 'link', href=_post_url(post))
+        if post.updated or post.timestamp:
+            ET.SubElement(entry, 'updated').text = _isoformat(post.updated or post.timestamp)
+        if post.timestamp:
+            ET.SubElement(entry, 'published').text = _isoformat(post.timestamp)
+        ET.SubElement(entry, 'content', type='html').text = _post_html(post)
+    return ET.ElementTree(feed)
+
+
+def render_rss():
+    posts = _recent_posts()
+    rss = ET.Element('rss', version='2.0')
+    channel = ET.SubElement(rss, 'channel')
+    ET.SubElement(channel, 'title').text = 'Photography Blog'
+    ET.SubElement(channel, 'link').text = _home_url()
+    ET.SubElement(channel, 'description').text = 'Latest photos'
+    for post in posts:
+        item = ET.SubElement(channel, 'item')
+        ET.SubElement(item, 'title').text = post.title or ''
+        ET.SubElement(item, 'link').text = _post_url(post)
+        ET.SubElement(item, 'guid', isPermaLink='true').text = _post_url(post)
+        if post.timestamp:
+            ET.SubElement(item, 'pubDate').text = format_datetime(post.timestamp.replace(tzinfo=timezone.utc))
+        ET.SubElement(item, 'description').text = _post_html(post)
+    return ET.ElementTree(rss)
+
+
+def render_sitemap():
+    urlset = ET.Element('urlset', {'xmlns': SITEMAP_NS, 'xmlns:image': IMAGE_NS})
+
+    latest = db.session.query(db.func.max(db.func.coalesce(Post.updated, Post.timestamp))).scalar()
+    home = ET.SubElement(urlset, 'url')
+    ET.SubElement(home, 'loc').text = _home_url()
+    if latest:
+        ET.SubElement(home, 'lastmod').text = _isoformat(latest)
+
+    # All posts are shown on the home page, so their photos are listed there.
+    # Only the columns needed are loaded, newest post first.
+    rows = db.session.query(Photo.image_filename, Photo.location, Photo.camera_make,
+                            Photo.camera_model, Photo.lens, Photo.focal_length,
+                            Photo.aperture, Photo.shutter_speed, Photo.iso, Post.title) \
+        .join(Post, Photo.post_id == Post.id) \
+        .filter(Photo.image_filename.isnot(None)) \
+        .order_by(Post.timestamp.desc(), Photo.id) \
+        .limit(SITEMAP_MAX_IMAGES)
+    for row in rows:
+        image = ET.SubElement(home, 'image:image')
+        ET.SubElement(image, 'image:loc').text = _photo_url(row)
+        if row.title:
+            ET.SubElement(image, 'image:title').text = row.title
+        caption = _photo_caption(row)
+        if caption:
+            ET.SubElement(image, 'image:caption').text = caption
+
+    about = ET.SubElement(urlset, 'url')
+    ET.SubElement(about, 'loc').text = _absolute_url(url_for('about'))
+    return ET.ElementTree(urlset)
+
+
+RENDERERS = {
+    'atom': render_atom,
+    'rss': render_rss,
+    'sitemap': render_sitemap,
+}
+
+
+def cached_feed_path(name):
+    """Path to the up-to-date rendering of feed ``name``, rendering it if needed."""
+    folder = app.config['FEED_CACHE_FOLDER']
+    # Read the version before querying, so a change committed mid-render
+    # leaves this file stale rather than being missed
+    version = current_version()
+    path = os.path.join(folder, f"{name}-{version}.xml")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    RENDERERS[name]().write(tmp_path, encoding='utf-8', xml_declaration=True)
+    os.replace(tmp_path, path)
+
+    # Only remove older renderings; a newer one may be about to be sent by a
+    # worker that read the version after this one did
+    for old in glob.glob(os.path.join(folder, f"{name}-*.xml")):
+        old_version = os.path.basename(old)[len(name) + 1:-len('.xml')]
+        if old_version.isdigit() and int(old_version) < int(version):
+            try:
+                os.remove(old)
+            except FileNotFoundError:
+                pass
+    return path
+
+
+def send_feed(name, mimetype):
+    """Send the cached rendering of feed ``name`` with conditional-request handling."""
+    try:
+        return send_file(cached_feed_path(name), mimetype=mimetype, conditional=True)
+    except FileNotFoundError:
+        # Removed by a worker that rendered a newer version in the meantime
+        return send_file(cached_feed_path(name), mimetype=mimetype, conditional=True)
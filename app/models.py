@@ -28,6 +28,9 @@ class Post(db.Model):
     body = db.Column(db.Text)
     image_filename = db.Column(db.String(140)) # Keeping for backward compatibility or cover image
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    # Last edit to the post or its photos (None until first edited), for feed
+    # <updated> and sitemap <lastmod>
+    updated = db.Column(db.DateTime)
     photos = db.relationship('Photo', backref='post', lazy='dynamic')
 
     def __repr__(self):
@@ -49,6 +52,9 @@ class Photo(db.Model):
     shutter_speed = db.Column(db.String(50))
     iso = db.Column(db.String(50))
 
+    # 64-bit perceptual (difference) hash as 16 hex digits, for near-duplicate detection
+    phash = db.Column(db.String(16))
+
     def __repr__(self):
         return '<Photo {}>'.format(self.image_filename)
 
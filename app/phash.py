@@ -0,0 +1,173 @@
+import time
+import threading
+from sqlalchemy import event
+from app import app, db
+from app.models import Photo
+
+# In-memory index of Photo perceptual hashes for near-duplicate lookup.
+#
+# Uses multi-index hashing: each 64-bit hash is split into (max_distance + 1)
+# substrings, each with its own exact-match table. By the pigeonhole
+# principle two hashes within max_distance bits agree exactly on at least
+# one substring, so a lookup only compares against the few hashes sharing a
+# bucket instead of scanning every photo.
+
+HASH_BITS = 64
+
+
+class MultiIndexHash:
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        parts = max_distance + 1
+        widths = [HASH_BITS // parts + (1 if i < HASH_BITS % parts else 0) for i in range(parts)]
+        self.slices = []
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self.slices.append((shift, (1 << width) - 1))
+        self.tables = [{} for _ in self.slices]
+        self.hashes = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def _keys(self, value):
+        return [(value >> shift) & mask for shift, mask in self.slices]
+
+    def add(self, photo_id, value):
+        if photo_id in self.hashes:
+            self.remove(photo_id)
+        self.hashes[photo_id] = value
+        for table, key in zip(self.tables, self._keys(value)):
+            table.setdefault(key, []).append(photo_id)
+
+    def remove(self, photo_id):
+        value = self.hashes.pop(photo_id, None)
+        if value is None:
+            return
+        for table, key in zip(self.tables, self._keys(value)):
+            bucket = table.get(key)
+            if bucket:
+                bucket.remove(photo_id)
+                if not bucket:
+                    del table[key]
+
+    def query(self, value, exclude=None):
+        """Return ``[(photo_id, distance)]`` within max_distance, closest first."""
+        seen = set()
+        matches = []
+        for table, key in zip(self.tables, self._keys(value)):
+            for photo_id in table.get(key, ()):
+                if photo_id in seen or photo_id == exclude:
+                    continue
+                seen.add(photo_id)
+                distance = (self.hashes[photo_id] ^ value).bit_count()
+                if distance <= self.max_distance:
+                    matches.append((photo_id, distance))
+        matches.sort(key=lambda m: (m[1], m[0]))
+        return matches
+
+
+class PhotoHashIndex:
+    """A MultiIndexHash of every Photo.phash, loaded from the database on first use.
+
+    Each gunicorn worker keeps its own copy, updated as this process commits
+    Photo changes (see the session hooks below), so a lookup normally never
+    touches the database. Changes made by other workers or scripts are picked
+    up by a drift check that runs at most every ``refresh_interval`` seconds:
+    it compares the number of stored hashes and the newest photo id with what
+    was loaded, adds newer photos incrementally and rebuilds otherwise.
+    """
+
+    def __init__(self, max_distance, refresh_interval):
+        self.max_distance = max_distance
+        self.refresh_interval = refresh_interval
+        self.index = None
+        self.loaded_state = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def _hashes(self):
+        return db.session.query(Photo.id, Photo.phash).filter(Photo.phash.isnot(None))
+
+    def _sync(self):
+        now = time.monotonic()
+        if self.index is not None and now - self.checked_at < self.refresh_interval:
+            return
+        self.checked_at = now
+
+        count, max_id = db.session.query(db.func.count(Photo.phash), db.func.max(Photo.id)) \
+            .filter(Photo.phash.isnot(None)).one()
+        if self.index is not None and (count, max_id) == self.loaded_state:
+            return
+
+        if (self.index is not None and max_id is not None and self.loaded_state[1] is not None
+                and max_id > self.loaded_state[1]):
+            for photo_id, phash in self._hashes().filter(Photo.id > self.loaded_state[1]):
+                self.index.add(photo_id, int(phash, 16))
+            if len(self.index) == count:
+                self.loaded_state = (count, max_id)
+                return
+
+        index = MultiIndexHash(self.max_distance)
+        for photo_id, phash in self._hashes():
+            index.add(photo_id, int(phash, 16))
+        self.index = index
+        self.loaded_state = (count, max_id)
+
+    def find_near_duplicates(self, phash, exclude=None):
+        with self.lock:
+            self._sync()
+            return self.index.query(int(phash, 16), exclude=exclude)
+
+    def apply(self, changes):
+        """Apply committed ``{photo_id: phash or None}`` changes to a loaded index."""
+        with self.lock:
+            if self.index is None:
+                return
+            for photo_id, phash in changes.items():
+                if phash:
+                    self.index.add(photo_id, int(phash, 16))
+                else:
+                    self.index.remove(photo_id)
+
+
+_photo_index = None
+
+
+def get_photo_index():
+    global _photo_index
+    if _photo_index is None:
+        _photo_index = PhotoHashIndex(app.config['PHASH_MAX_DISTANCE'],
+                                      app.config['PHASH_INDEX_REFRESH_SECONDS'])
+    return _photo_index
+
+
+@event.listens_for(db.session, 'after_flush')
+def _track_hash_changes(session, flush_context):
+    changes = session.info.setdefault('phash_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Photo):
+            changes[obj.id] = obj.phash
+    for obj in session.deleted:
+        if isinstance(obj, Photo):
+            changes[obj.id] = None
+
+
+@event.listens_for(db.session, 'after_commit')
+def _apply_hash_changes(session):
+    changes = session.info.pop('phash_changes', None)
+    if changes and _photo_index is not None:
+        _photo_index.apply(changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_hash_changes(session):
+    session.info.pop('phash_changes', None)
+
+
+@event.listens_for(Photo.image_filename, 'set')
+def _reset_hash_on_new_file(target, value, oldvalue, initiator):
+    # The admin form only assigns image_filename when a file is uploaded, even
+    # if it keeps the old name, so a replaced file is always hashed again
+    target.phash = None
@@ -3,16 +3,23 @@ import requests
 import time
 from cryptography.hazmat.primitives.asymmetric import ed25519
 from cryptography.hazmat.primitives import serialization
-from flask import render_template, flash, redirect, url_for, request, send_from_directory
+from flask import render_template, flash, redirect, url_for, request, send_from_directory, jsonify, abort, Response
 from flask_login import current_user, login_user, logout_user, login_required
 from flask_admin import BaseView, expose
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.form.upload import ImageUploadField
 from flask_admin.model.form import InlineFormAdmin
 from flask_admin.menu import MenuLink
+from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 from app import app, db, admin
 from app.models import User, Post, Photo, Profile
-from app.utils import process_image_metadata, fix_image_orientation
+from app.utils import process_image_metadata, fix_image_orientation, compute_dhash
+from app.uploads import UploadError, start_upload, load_upload, upload_part_path, write_chunk, finish_upload, abort_upload
+from app.archive import ZipStream
+from app.feeds import send_feed
+from app.tiles import current_dzi, schedule_tiles
+from app.phash import MultiIndexHash, get_photo_index
 
 # Add link to public site in menu
 admin.add_link(MenuLink(name='View Site', url='/'))
@@ -32,7 +39,89 @@ class SecureModelView(ModelView):
     def inaccessible_callback(self, name, **kwargs):
         return redirect(url_for('login'))
 
+def ingest_photo(photo):
+    """Extract metadata and fix orientation for a photo whose file is in UPLOAD_FOLDER.
+
+    Returns True if any metadata field on the row was filled in.
+    """
+    metadata_updated = False
+    print(f"DEBUG: Processing photo: {photo.image_filename}")
+    if photo.image_filename:
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], photo.image_filename)
+        print(f"DEBUG: Checking file path: {file_path}")
+
+        # Check if file exists
+        if os.path.exists(file_path):
+            print(f"DEBUG: File exists. Processing metadata...")
+            try:
+                # First, try to extract metadata from the file
+                # We do this BEFORE fixing orientation because saving the image might strip EXIF
+                metadata = process_image_metadata(file_path)
+                print(f"DEBUG: Metadata extracted: {metadata}")
+
+                # Now fix the orientation (rotate image if needed)
+                fix_image_orientation(file_path)
+
+                # Tiles are cut from the correctly oriented file
+                schedule_tiles(app.config, photo.image_filename)
+
+                if metadata:
+                    # Only update fields if they are NOT already set (e.g. by the user/JS)
+                    # or if we want to enforce server-side extraction.
+                    # Given the user report, we should prioritize existing data if present.
+
+                    if not photo.date_taken and metadata.get('date_taken'):
+                        photo.date_taken = metadata.get('date_taken')
+                        metadata_updated = True
+
+                    if not photo.location and metadata.get('location'):
+                        photo.location = metadata.get('location')
+                        metadata_updated = True
+
+                    if not photo.camera_make and metadata.get('camera_make'):
+                        photo.camera_make = metadata.get('camera_make')
+                        metadata_updated = True
+
+                    if not photo.camera_model and metadata.get('camera_model'):
+                        photo.camera_model = metadata.get('camera_model')
+                        metadata_updated = True
+
+                    if not photo.lens and metadata.get('lens'):
+                        photo.lens = metadata.get('lens')
+                        metadata_updated = True
+
+                    if not photo.focal_length and metadata.get('focal_length'):
+                        photo.focal_length = metadata.get('focal_length')
+                        metadata_updated = True
+
+                    if not photo.aperture and metadata.get('aperture'):
+                        photo.aperture = metadata.get('aperture')
+                        metadata_updated = True
+
+                    if not photo.shutter_speed and metadata.get('shutter_speed'):
+                        photo.shutter_speed = metadata.get('shutter_speed')
+                        metadata_updated = True
+
+                    if not photo.iso and metadata.get('iso'):
+                        photo.iso = str(metadata.get('iso'))
+                        metadata_updated = True
+
+            except Exception as e:
+                print(f"DEBUG: Error processing metadata: {e}")
+        else:
+            print(f"DEBUG: File does not exist at {file_path}")
+    return metadata_updated
+
+def find_near_duplicates(phash, exclude=None):
+    """Return ``[(photo, distance)]`` for stored photos that look like ``phash``."""
+    matches = get_photo_index().find_near_duplicates(phash, exclude=exclude)
+    photos = {p.id: p for p in Photo.query.filter(Photo.id.in_([m[0] for m in matches]))} if matches else {}
+    return [(photos[photo_id], distance) for photo_id, distance in matches if photo_id in photos]
+
 class PhotoInlineModelView(InlineFormAdmin):
+    # phash is computed from the file; if it were a form field, saving would
+    # write the old hash back after a replaced upload cleared it
+    form_excluded_columns = ('phash',)
     form_overrides = dict(image_filename=ImageUploadField)
     form_args = dict(image_filename=dict(
         label='Image',
@@ -54,75 +143,42 @@ class PostView(SecureModelView):
         url_relative_path='uploads/'
     ))
     
+    form_excluded_columns = ('updated',)
     inline_models = (PhotoInlineModelView(Photo),)
 
     def after_model_change(self, form, model, is_created):
         # Process metadata for photos
         print(f"DEBUG: after_model_change called. is_created={is_created}")
         metadata_updated = False
+        # Photos hashed in this save only reach the shared index once the save
+        # is committed, so they are also checked against each other here
+        saved_hashes = MultiIndexHash(app.config['PHASH_MAX_DISTANCE'])
+        saved_photos = {}
         for photo in model.photos:
-            print(f"DEBUG: Processing photo: {photo.image_filename}")
-            if photo.image_filename:
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], photo.image_filename)
-                print(f"DEBUG: Checking file path: {file_path}")
-                
-                # Check if file exists
-                if os.path.exists(file_path):
-                    print(f"DEBUG: File exists. Processing metadata...")
-                    try:
-                        # First, try to extract metadata from the file
-                        # We do this BEFORE fixing orientation because saving the image might strip EXIF
-                        metadata = process_image_metadata(file_path)
-                        print(f"DEBUG: Metadata extracted: {metadata}")
-                        
-                        # Now fix the orientation (rotate image if needed)
-                        fix_image_orientation(file_path)
-                        
-                        if metadata:
-                            # Only update fields if they are NOT already set (e.g. by the user/JS)
-                            # or if we want to enforce server-side extraction.
-                            # Given the user report, we should prioritize existing data if present.
-                            
-                            if not photo.date_taken and metadata.get('date_taken'):
-                                photo.date_taken = metadata.get('date_taken')
-                                metadata_updated = True
-                                
-                            if not photo.location and metadata.get('location'):
-                                photo.location = metadata.get('location')
-                                metadata_updated = True
-                                
-                            if not photo.camera_make and metadata.get('camera_make'):
-                                photo.camera_make = metadata.get('camera_make')
-                                metadata_updated = True
-                                
-                            if not photo.camera_model and metadata.get('camera_model'):
-                                photo.camera_model = metadata.get('camera_model')
-                                metadata_updated = True
-                                
-                            if not photo.lens and metadata.get('lens'):
-                                photo.lens = metadata.get('lens')
-                                metadata_updated = True
-                                
-                            if not photo.focal_length and metadata.get('focal_length'):
-                                photo.focal_length = metadata.get('focal_length')
-                                metadata_updated = True
-                                
-                            if not photo.aperture and metadata.get('aperture'):
-                                photo.aperture = metadata.get('aperture')
-                                metadata_updated = True
-                                
-                            if not photo.shutter_speed and metadata.get('shutter_speed'):
-                                photo.shutter_speed = metadata.get('shutter_speed')
-                                metadata_updated = True
-                                
-                            if not photo.iso and metadata.get('iso'):
-                                photo.iso = str(metadata.get('iso'))
-                                metadata_updated = True
-                                
-                    except Exception as e:
-                        print(f"DEBUG: Error processing metadata: {e}")
-                else:
-                    print(f"DEBUG: File does not exist at {file_path}")
+            # Only new photos and replaced files (whose hash was reset) go
+            # through the pipeline; re-running it on every save would rebuild
+            # tile pyramids and break cached tile and ZIP URLs
+            if photo.phash or not photo.image_filename:
+                continue
+            # Hash first so near-duplicates are flagged before the rest of the
+            # pipeline runs
+            file_path = os.path.join(app.config['UPLOAD_FOLDER'], photo.image_filename)
+            if os.path.exists(file_path):
+                photo.phash = compute_dhash(file_path)
+            if photo.phash:
+                metadata_updated = True
+                value = int(photo.phash, 16)
+                duplicates = find_near_duplicates(photo.phash, exclude=photo.id)
+                found = {duplicate.id for duplicate, distance in duplicates}
+                duplicates += [(saved_photos[photo_id], distance) for photo_id, distance in saved_hashes.query(value)
+                               if photo_id not in found]
+                for duplicate, distance in duplicates:
+                    flash(f"'{photo.image_filename}' looks like a near-duplicate of '{duplicate.image_filename}' "
+                          f"in post '{duplicate.post.title if duplicate.post else 'none'}' ({distance} bits apart).", 'warning')
+                saved_hashes.add(photo.id, value)
+                saved_photos[photo.id] = photo
+            if ingest_photo(photo):
+                metadata_updated = True
         
         if metadata_updated:
             db.session.commit()
@@ -260,7 +316,175 @@ def logout():
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+@app.route('/post/<int:post_id>/photos.zip')
+def download_post_photos(post_id):
+    post = db.get_or_404(Post, post_id)
+    files = []
+    for photo in post.photos.order_by(Photo.id):
+        if not photo.image_filename:
+            continue
+        path = os.path.join(app.config['UPLOAD_FOLDER'], photo.image_filename)
+        if os.path.exists(path):
+            files.append((photo.image_filename, path))
+    if not files:
+        abort(404)
+
+    # Only the archive layout is built here; file contents are read block by
+    # block as the response is sent, so memory use doesn't grow with the shoot
+    zipped = ZipStream(files)
+    etag = zipped.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    start, stop = 0, zipped.size
+    status = 200
+    byte_range = request.range
+    if_range = request.if_range
+    # A stale If-Range means the client's partial copy is of a different archive.
+    # Multi-range requests aren't supported and get the whole archive instead.
+    if (byte_range and len(byte_range.ranges) == 1
+            and (not (if_range.etag or if_range.date) or if_range.etag == etag)):
+        bounds = byte_range.range_for_length(zipped.size)
+        if bounds is None:
+            response = Response(status=416)
+            response.headers['Content-Range'] = f"bytes */{zipped.size}"
+            return response
+        start, stop = bounds
+        status = 206
+
+    response = Response(zipped.iter_bytes(start, stop), status=status,
+                        mimetype='application/zip', direct_passthrough=True)
+    response.content_length = stop - start
+    if status == 206:
+        response.headers['Content-Range'] = f"bytes {start}-{stop - 1}/{zipped.size}"
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = zipped.last_modified
+    filename = secure_filename(post.title or '') or f"post-{post.id}"
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.zip"'
+    return response
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    return jsonify(error=e.message, **e.extra), e.status
+
+# Chunked uploads for large originals. The client starts an upload, PUTs the
+# file in chunks of at most UPLOAD_CHUNK_SIZE bytes (resuming from the offset
+# reported by GET after a disconnect), then completes it to create the Photo.
+@app.route('/upload/chunked', methods=['POST'])
+@login_required
+def chunked_upload_start():
+    data = request.get_json(silent=True) or {}
+    post = db.session.get(Post, data.get('post_id') or 0)
+    if post is None:
+        raise UploadError('Unknown post', status=404)
+    state = start_upload(app.config['CHUNKED_UPLOAD_FOLDER'], data.get('filename'), data.get('size'), post.id)
+    return jsonify(upload_id=state['id'], offset=0, chunk_size=app.config['UPLOAD_CHUNK_SIZE']), 201
+
+@app.route('/upload/chunked/<upload_id>', methods=['GET'])
+@login_required
+def chunked_upload_status(upload_id):
+    state = load_upload(app.config['CHUNKED_UPLOAD_FOLDER'], upload_id)
+    return jsonify(upload_id=state['id'], offset=state['offset'], size=state['size'],
+                   sha256=state['sha256'], chunk_size=app.config['UPLOAD_CHUNK_SIZE'])
+
+@app.route('/upload/chunked/<upload_id>', methods=['PUT'])
+@login_required
+def chunked_upload_chunk(upload_id):
+    tmp_dir = app.config['CHUNKED_UPLOAD_FOLDER']
+    state = load_upload(tmp_dir, upload_id)
+    length = request.content_length
+    if length is None:
+        raise UploadError('Content-Length is required', status=411)
+    if length > app.config['UPLOAD_CHUNK_SIZE']:
+        raise UploadError('Chunk too large', status=413, chunk_size=app.config['UPLOAD_CHUNK_SIZE'])
+    try:
+        offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        raise UploadError('Upload-Offset header is required')
+
+    # Read from request.stream rather than request.data so the chunk goes
+    # straight to disk instead of being buffered
+    state = write_chunk(tmp_dir, state, offset, request.stream, length,
+                        request.headers.get('X-Chunk-SHA256'))
+    return jsonify(upload_id=state['id'], offset=state['offset'], sha256=state['sha256'])
+
+@app.route('/upload/chunked/<upload_id>', methods=['DELETE'])
+@login_required
+def chunked_upload_abort(upload_id):
+    tmp_dir = app.config['CHUNKED_UPLOAD_FOLDER']
+    abort_upload(tmp_dir, load_upload(tmp_dir, upload_id))
+    return '', 204
+
+@app.route('/upload/chunked/<upload_id>/complete', methods=['POST'])
+@login_required
+def chunked_upload_complete(upload_id):
+    tmp_dir = app.config['CHUNKED_UPLOAD_FOLDER']
+    state = load_upload(tmp_dir, upload_id)
+    data = request.get_json(silent=True) or {}
+    post = db.session.get(Post, state['post_id'])
+    if post is None:
+        raise UploadError('Unknown post', status=404)
+
+    # Check for near-duplicates while the file is still in the temp folder, so
+    # the client can confirm (allow_duplicate) or abort before it is ingested
+    phash = compute_dhash(upload_part_path(tmp_dir, state))
+    if phash and not data.get('allow_duplicate'):
+        duplicates = find_near_duplicates(phash)
+        if duplicates:
+            raise UploadError('Near-duplicate of existing photos', status=409, duplicates=[
+                dict(photo_id=p.id, post_id=p.post_id, filename=p.image_filename, distance=distance)
+                for p, distance in duplicates
+            ])
+
+    filename = finish_upload(tmp_dir, state, app.config['UPLOAD_FOLDER'], sha256=data.get('sha256'))
+    photo = Photo(image_filename=filename, post=post)
+    photo.phash = phash
+    db.session.add(photo)
+    ingest_photo(photo)
+    db.session.commit()
+    return jsonify(photo_id=photo.id, filename=filename), 201
+
 @app.route('/about')
 def about():
     profile = Profile.query.first()
     return render_template('about.html', title='About Me', profile=profile)
+
+# Feeds and the sitemap are served from pre-rendered files that are only
+# rebuilt after a Post or Photo changes; send_feed handles ETag and
+# If-Modified-Since revalidation
+@app.route('/feed.atom')
+def atom_feed():
+    return send_feed('atom', 'application/atom+xml')
+
+@app.route('/feed.rss')
+def rss_feed():
+    return send_feed('rss', 'application/rss+xml')
+
+@app.route('/sitemap.xml')
+def sitemap():
+    return send_feed('sitemap', 'application/xml')
+
+@app.template_global()
+def photo_tiles_url(photo):
+    """URL of the deep-zoom descriptor for a photo, or None if it has no tiles yet."""
+    if not photo.image_filename:
+        return None
+    version = current_dzi(app.config['UPLOAD_FOLDER'], app.config['TILES_FOLDER'], photo.image_filename)
+    if version is None:
+        return None
+    return url_for('photo_tile', filename=photo.image_filename, version=version, path='image.dzi')
+
+@app.route('/tiles/<filename>/<version>/<path:path>')
+def photo_tile(filename, version, path):
+    # The version in the URL changes whenever the original does, so tiles
+    # can be cached by browsers and proxies indefinitely
+    directory = safe_join(app.config['TILES_FOLDER'], filename, version)
+    if directory is None:
+        abort(404)
+    response = send_from_directory(directory, path, max_age=31536000)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
@@ -0,0 +1,122 @@
+import os
+import math
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+# Deep Zoom (DZI) tile pyramids for full-screen viewing. Each photo gets
+#   TILES_FOLDER/<image_filename>/<version>/image.dzi
+#   TILES_FOLDER/<image_filename>/<version>/image_files/<level>/<col>_<row>.jpg
+# where <version> is derived from the original's size and mtime. A replaced
+# original gets a new version directory, so tile URLs never change content
+# and can be cached forever.
+
+DZI_NAMESPACE = 'http://schemas.microsoft.com/deepzoom/2008'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def tile_version(src_path):
+    stat = os.stat(src_path)
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+
+
+def dzi_path(tiles_root, filename, version):
+    return os.path.join(tiles_root, filename, version, 'image.dzi')
+
+
+def current_dzi(upload_folder, tiles_root, filename):
+    """Return the tile version for ``filename`` if its pyramid is up to date, else None."""
+    try:
+        version = tile_version(os.path.join(upload_folder, filename))
+    except OSError:
+        return None
+    if os.path.exists(dzi_path(tiles_root, filename, version)):
+        return version
+    return None
+
+
+def build_dzi(src_path, tiles_root, filename, tile_size=254, overlap=1, quality=85):
+    """Build the tile pyramid for one original. Returns the version built.
+
+    Levels are produced from the top down, each by halving the one above it,
+    so the original is decoded once. image.dzi is written last and the whole
+    version directory is moved into place at the end, so a half-built pyramid
+    is never visible.
+    """
+    version = tile_version(src_path)
+    photo_dir = os.path.join(tiles_root, filename)
+    final_dir = os.path.join(photo_dir, version)
+    if os.path.exists(os.path.join(final_dir, 'image.dzi')):
+        return version
+
+    build_dir = os.path.join(photo_dir, f".{version}.{os.getpid()}.tmp")
+    shutil.rmtree(build_dir, ignore_errors=True)
+    files_dir = os.path.join(build_dir, 'image_files')
+
+    with Image.open(src_path) as img:
+        level_image = img.convert('RGB')
+    width, height = level_image.size
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+
+    for level in range(max_level, -1, -1):
+        scale = 2 ** (max_level - level)
+        level_size = (max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale)))
+        if level_image.size != level_size:
+            level_image = level_image.resize(level_size, Image.LANCZOS)
+
+        level_dir = os.path.join(files_dir, str(level))
+        os.makedirs(level_dir)
+        level_width, level_height = level_size
+        for col in range(math.ceil(level_width / tile_size)):
+            for row in range(math.ceil(level_height / tile_size)):
+                left = max(col * tile_size - overlap, 0)
+                top = max(row * tile_size - overlap, 0)
+                right = min((col + 1) * tile_size + overlap, level_width)
+                bottom = min((row + 1) * tile_size + overlap, level_height)
+                tile = level_image.crop((left, top, right, bottom))
+                tile.save(os.path.join(level_dir, f"{col}_{row}.jpg"), quality=quality)
+
+    with open(os.path.join(build_dir, 'image.dzi'), 'w') as f:
+        f.write(
+            f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="{DZI_NAMESPACE}" Format="jpg" Overlap="{overlap}" TileSize="{tile_size}">'
+            f'<Size Width="{width}" Height="{height}"/></Image>\n'
+        )
+
+    try:
+        os.rename(build_dir, final_dir)
+    except OSError:
+        # Another process finished the same version first
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    # Pyramids for earlier versions of this file are no longer referenced
+    for name in os.listdir(photo_dir):
+        if name != version and not name.startswith('.'):
+            shutil.rmtree(os.path.join(photo_dir, name), ignore_errors=True)
+    print(f"Built tiles for {filename} ({width}x{height}, {max_level + 1} levels)")
+    return version
+
+
+def _build_dzi_safely(*args, **kwargs):
+    try:
+        return build_dzi(*args, **kwargs)
+    except Exception as e:
+        print(f"Error building tiles for {args[2]}: {e}")
+
+
+def schedule_tiles(config, filename):
+    """Queue a tile build for ``filename`` in a background process, if enabled."""
+    if not config.get('TILES_ENABLED') or not filename:
+        return
+    if current_dzi(config['UPLOAD_FOLDER'], config['TILES_FOLDER'], filename):
+        return
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=config.get('TILES_WORKERS', 1))
+        _executor.submit(_build_dzi_safely, os.path.join(config['UPLOAD_FOLDER'], filename),
+                         config['TILES_FOLDER'], filename, config['TILE_SIZE'])
@@ -0,0 +1,198 @@
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+from werkzeug.utils import secure_filename
+
+# Size of each read from the request stream / temp file. Together with the
+# configured chunk size this bounds how much of an upload is held in memory.
+READ_BLOCK_SIZE = 64 * 1024
+
+ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'gif', 'tiff', 'tif', 'heic', 'heif', 'webp'}
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.extra = extra
+
+
+def _state_path(tmp_dir, upload_id):
+    return os.path.join(tmp_dir, f"{upload_id}.json")
+
+
+def _part_path(tmp_dir, upload_id):
+    return os.path.join(tmp_dir, f"{upload_id}.part")
+
+
+def _save_state(tmp_dir, state):
+    # Write to a temp file and rename so a crash never leaves half-written state
+    path = _state_path(tmp_dir, state['id'])
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def chain_hash(previous, chunk_digest):
+    """Fold one chunk's SHA-256 into the running upload hash.
+
+    The running hash is sha256(previous_hash + chunk_hash), starting from an
+    empty string. Unlike a plain sha256 object it survives being written to
+    disk, so an upload can be resumed by a different worker process.
+    """
+    return hashlib.sha256(bytes.fromhex(previous) + chunk_digest).hexdigest()
+
+
+def start_upload(tmp_dir, filename, size, post_id):
+    filename = secure_filename(filename or '')
+    if not filename or '.' not in filename:
+        raise UploadError('A filename with an extension is required')
+    if filename.rsplit('.', 1)[1].lower() not in ALLOWED_EXTENSIONS:
+        raise UploadError(f"File type not allowed: {filename}")
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('File size is required')
+    if size <= 0:
+        raise UploadError('File size must be positive')
+
+    os.makedirs(tmp_dir, exist_ok=True)
+    state = {
+        'id': uuid.uuid4().hex,
+        'filename': filename,
+        'size': size,
+        'post_id': post_id,
+        'offset': 0,
+        'sha256': '',
+    }
+    open(_part_path(tmp_dir, state['id']), 'wb').close()
+    _save_state(tmp_dir, state)
+    return state
+
+
+def load_upload(tmp_dir, upload_id):
+    # upload_id ends up in a path, so only accept what start_upload generates
+    try:
+        upload_id = uuid.UUID(hex=upload_id).hex
+    except ValueError:
+        raise UploadError('Unknown upload', status=404)
+    try:
+        with open(_state_path(tmp_dir, upload_id)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadError('Unknown upload', status=404)
+
+
+@contextmanager
+def _locked_upload(tmp_dir, state):
+    """Hold an exclusive lock on the upload's .part file and yield (file, current state).
+
+    Writing a chunk, finishing and aborting all take this lock, so concurrent
+    requests for the same upload are serialized. The state is re-read once the
+    lock is held because the caller's copy may be stale by then; if another
+    request finished or aborted the upload meanwhile, this raises a 404.
+    """
+    try:
+        f = open(_part_path(tmp_dir, state['id']), 'r+b')
+    except FileNotFoundError:
+        raise UploadError('Unknown upload', status=404)
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield f, load_upload(tmp_dir, state['id'])
+
+
+def upload_part_path(tmp_dir, state):
+    """Path of the received data, for inspecting a complete upload before finishing it."""
+    if state['offset'] != state['size']:
+        raise UploadError('Upload is incomplete', status=409, offset=state['offset'])
+    return _part_path(tmp_dir, state['id'])
+
+
+def write_chunk(tmp_dir, state, offset, stream, length, chunk_sha256):
+    """Stream one chunk from ``stream`` to the end of the upload's temp file.
+
+    The chunk is hashed as it is written and rolled back if it is short or the
+    hash does not match, leaving the upload ready to retry the same offset.
+    """
+    if not chunk_sha256:
+        raise UploadError('Chunk SHA-256 is required')
+
+    with _locked_upload(tmp_dir, state) as (f, state):
+        if offset != state['offset']:
+            raise UploadError('Offset mismatch', status=409, offset=state['offset'])
+        if offset + length > state['size']:
+            raise UploadError('Chunk exceeds declared file size')
+
+        digest = hashlib.sha256()
+        received = 0
+        f.seek(offset)
+        f.truncate()
+        while received < length:
+            block = stream.read(min(READ_BLOCK_SIZE, length - received))
+            if not block:
+                break
+            f.write(block)
+            digest.update(block)
+            received += len(block)
+
+        if received != length or digest.hexdigest() != chunk_sha256.lower():
+            f.truncate(offset)
+            raise UploadError('Chunk was incomplete or corrupted', status=422, offset=offset)
+
+        state['offset'] = offset + length
+        state['sha256'] = chain_hash(state['sha256'], digest.digest())
+        _save_state(tmp_dir, state)
+    return state
+
+
+def _claim_filename(dest_dir, filename, upload_id):
+    """Create an empty placeholder for a free name in ``dest_dir`` and return the name.
+
+    O_EXCL makes the check and the claim one step, so two uploads of the same
+    filename finishing together can't both pick it and overwrite each other.
+    """
+    stem, ext = os.path.splitext(filename)
+    for candidate in (filename, f"{stem}_{upload_id[:8]}{ext}", f"{stem}_{upload_id}{ext}"):
+        try:
+            os.close(os.open(os.path.join(dest_dir, candidate), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644))
+            return candidate
+        except FileExistsError:
+            continue
+    raise UploadError(f"No free filename for {filename}", status=409)
+
+
+def finish_upload(tmp_dir, state, dest_dir, sha256=None):
+    """Move a fully received upload into ``dest_dir`` and return its filename."""
+    with _locked_upload(tmp_dir, state) as (f, state):
+        if state['offset'] != state['size']:
+            raise UploadError('Upload is incomplete', status=409, offset=state['offset'])
+        if sha256 and sha256.lower() != state['sha256']:
+            raise UploadError('Upload hash does not match', status=422)
+
+        filename = _claim_filename(dest_dir, state['filename'], state['id'])
+        dest = os.path.join(dest_dir, filename)
+        # Replaces the placeholder. shutil.move falls back to a streaming copy
+        # when the temp folder and the upload folder live on different volumes
+        # (e.g. in docker-compose)
+        try:
+            shutil.move(_part_path(tmp_dir, state['id']), dest)
+        except Exception:
+            os.remove(dest)
+            raise
+        # Removed while still locked, so a request waiting on the lock sees a 404
+        os.remove(_state_path(tmp_dir, state['id']))
+    return filename
+
+
+def abort_upload(tmp_dir, state):
+    with _locked_upload(tmp_dir, state):
+        for path in (_part_path(tmp_dir, state['id']), _state_path(tmp_dir, state['id'])):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
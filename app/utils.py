@@ -1,31 +1,64 @@
 from PIL import Image, ExifTags, ImageOps
 from geopy.geocoders import Nominatim
+from geopy.extra.rate_limiter import RateLimiter
 from datetime import datetime
 import pillow_heif
 
 # Register HEIF opener
 pillow_heif.register_heif_opener()
 
+# Nominatim's usage policy allows at most one request per second. The limiter
+# is shared by every call in this process, so back-to-back photos (e.g. in
+# reprocess_metadata.py --geocode) are spaced out rather than sent in a burst.
+reverse_geocode = RateLimiter(Nominatim(user_agent="photography_blog_v01d").reverse,
+                              min_delay_seconds=1, max_retries=0, swallow_exceptions=False)
+
 def fix_image_orientation(image_path):
     try:
-        image = Image.open(image_path)
-        # exif_transpose will rotate the image according to the EXIF orientation tag
-        # and remove the orientation tag.
-        transposed_image = ImageOps.exif_transpose(image)
-        
-        # If the image was actually rotated/transposed
-        if transposed_image is not image:
-            # Save the image back to the same path
-            # We try to preserve the original format
-            # Note: This might strip other EXIF data depending on how it's saved,
-            # but since we extract metadata to DB separately, visual correctness is priority here.
-            transposed_image.save(image_path, quality=95)
-            print(f"Fixed orientation for {image_path}")
-            return True
+        with Image.open(image_path) as image:
+            # Nothing to do (and no reason to rewrite the file) unless the
+            # EXIF Orientation tag asks for a rotation or flip
+            orientation = image.getexif().get(0x0112)
+            if orientation in (None, 1):
+                return False
+            # exif_transpose will rotate the image according to the EXIF orientation tag
+            # and remove the orientation tag.
+            transposed_image = ImageOps.exif_transpose(image)
+
+        # Save the image back to the same path, keeping the rest of the EXIF
+        # so metadata can still be re-extracted from the file later
+        transposed_image.save(image_path, quality=95, exif=transposed_image.getexif().tobytes())
+        print(f"Fixed orientation for {image_path}")
+        return True
     except Exception as e:
         print(f"Error fixing orientation for {image_path}: {e}")
     return False
 
+def compute_dhash(image_path, hash_size=8):
+    """64-bit difference hash of an image as 16 hex digits, or None on error.
+
+    Uses a reduced decode (JPEG DCT scaling via draft) since only a tiny
+    grayscale thumbnail is needed, and applies the EXIF orientation so a
+    rotated copy of the same frame hashes the same.
+    """
+    try:
+        with Image.open(image_path) as img:
+            img.draft('L', (hash_size * 16, hash_size * 16))
+            img = ImageOps.exif_transpose(img).convert('L')
+            img = img.resize((hash_size + 1, hash_size), Image.LANCZOS)
+            pixels = list(img.getdata())
+    except Exception as e:
+        print(f"Error hashing {image_path}: {e}")
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
 def get_decimal_from_dms(dms, ref):
     degrees = dms[0]
     minutes = dms[1]
@@ -51,7 +84,7 @@ def get_lat_lon(exif_data):
             return get_decimal_from_dms(lat_dms, lat_ref), get_decimal_from_dms(lon_dms, lon_ref)
     return None
 
-def process_image_metadata(image_path):
+def process_image_metadata(image_path, geocode=True):
     try:
         img = Image.open(image_path)
         exif_data = {}
@@ -91,12 +124,11 @@ def process_image_metadata(image_path):
         
     metadata['iso'] = exif_data.get('ISOSpeedRatings')
 
-    # Location
-    lat_lon = get_lat_lon(exif_data)
+    # Location (reverse geocoding is a network call, so batch jobs can skip it)
+    lat_lon = get_lat_lon(exif_data) if geocode else None
     if lat_lon:
-        geolocator = Nominatim(user_agent="photography_blog_v01d")
         try:
-            location = geolocator.reverse(lat_lon, language='en')
+            location = reverse_geocode(lat_lon, language='en')
             # Try to get a shorter address (City, Country)
             address = location.raw.get('address', {})
             city = address.get('city') or address.get('town') or address.get('village')
@@ -0,0 +1,30 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from app import app, db
+from app.models import Photo
+from app.utils import compute_dhash
+
+BATCH_SIZE = 500
+
+def backfill_phash():
+    with app.app_context():
+        upload_folder = app.config['UPLOAD_FOLDER']
+        rows = Photo.query.with_entities(Photo.id, Photo.image_filename) \
+            .filter(Photo.phash.is_(None), Photo.image_filename.isnot(None)).all()
+        print(f"{len(rows)} photos without a perceptual hash.")
+
+        updated = 0
+        with ProcessPoolExecutor() as executor:
+            for start in range(0, len(rows), BATCH_SIZE):
+                batch = rows[start:start + BATCH_SIZE]
+                paths = [os.path.join(upload_folder, filename) for _, filename in batch]
+                hashes = executor.map(compute_dhash, paths, chunksize=16)
+                values = [dict(id=photo_id, phash=phash) for (photo_id, _), phash in zip(batch, hashes) if phash]
+                if values:
+                    db.session.execute(db.update(Photo), values)
+                    db.session.commit()
+                    updated += len(values)
+        print(f"Stored {updated} hashes.")
+
+if __name__ == '__main__':
+    backfill_phash()
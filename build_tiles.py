@@ -0,0 +1,30 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from app import app
+from app.models import Photo
+from app.tiles import build_dzi, current_dzi
+
+def build_tiles():
+    with app.app_context():
+        upload_folder = app.config['UPLOAD_FOLDER']
+        tiles_folder = app.config['TILES_FOLDER']
+        filenames = [name for (name,) in Photo.query.with_entities(Photo.image_filename)
+                     if name and os.path.exists(os.path.join(upload_folder, name))]
+        pending = [name for name in filenames if not current_dzi(upload_folder, tiles_folder, name)]
+        print(f"{len(filenames)} photos, {len(pending)} need tiles.")
+
+        workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(build_dzi, os.path.join(upload_folder, name), tiles_folder, name, app.config['TILE_SIZE']): name
+                for name in pending
+            }
+            for future, name in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error building tiles for {name}: {e}")
+
+if __name__ == '__main__':
+    build_tiles()
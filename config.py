@@ -8,3 +8,26 @@ class Config:
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(basedir, 'app/static/uploads')
+
+    # Chunked uploads are assembled here before being moved into UPLOAD_FOLDER
+    CHUNKED_UPLOAD_FOLDER = os.path.join(basedir, 'instance/chunked_uploads')
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE') or 8 * 1024 * 1024)
+
+    # Scheme and host used for absolute links in the feeds and sitemap. They are
+    # cached and served to everyone, so the request's Host header is not used.
+    SITE_URL = (os.environ.get('SITE_URL') or 'http://localhost:5000').rstrip('/')
+    # Pre-rendered Atom/RSS feeds and sitemap
+    FEED_CACHE_FOLDER = os.path.join(basedir, 'instance/feeds')
+
+    # Deep-zoom tile pyramids for the full-screen viewer. Building is optional;
+    # existing tiles are served either way.
+    TILES_ENABLED = os.environ.get('TILES_ENABLED', '').lower() in ('1', 'true', 'yes')
+    TILES_FOLDER = os.path.join(basedir, 'instance/tiles')
+    TILE_SIZE = 254
+    TILES_WORKERS = int(os.environ.get('TILES_WORKERS') or 1)
+
+    # Photos whose perceptual hashes differ in at most this many of 64 bits
+    # are flagged as near-duplicates at upload
+    PHASH_MAX_DISTANCE = int(os.environ.get('PHASH_MAX_DISTANCE') or 6)
+    # How often each worker checks its in-memory hash index against the database
+    PHASH_INDEX_REFRESH_SECONDS = 60
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from app import app, db
+from app.models import Photo
+from app.utils import process_image_metadata
+from app.feeds import invalidate_feeds
+
+METADATA_FIELDS = ['date_taken', 'location', 'camera_make', 'camera_model', 'lens',
+                   'focal_length', 'aperture', 'shutter_speed', 'iso']
+
+
+def extract(args):
+    path, geocode = args
+    if not os.path.exists(path):
+        return None
+    metadata = process_image_metadata(path, geocode=geocode)
+    # Same normalisation as the admin ingest step
+    if metadata.get('iso') is not None:
+        metadata['iso'] = str(metadata['iso'])
+    return metadata
+
+
+def changed_fields(row, metadata):
+    """Fields where newly extracted metadata differs from the stored value.
+
+    Values the file no longer yields are left alone, so manual edits for
+    fields the EXIF doesn't cover survive a reprocess.
+    """
+    changes = {}
+    for field in METADATA_FIELDS:
+        value = metadata.get(field)
+        if value is not None and value != '' and value != getattr(row, field):
+            changes[field] = value
+    return changes
+
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+def reprocess_metadata(dry_run=False, restart=False, batch_size=500, workers=None, geocode=False):
+    with app.app_context():
+        upload_folder = app.config['UPLOAD_FOLDER']
+        checkpoint_path = os.path.join(app.instance_path, 'reprocess_checkpoint.json')
+        os.makedirs(app.instance_path, exist_ok=True)
+
+        checkpoint = None if restart or dry_run else load_checkpoint(checkpoint_path)
+        if checkpoint:
+            print(f"Resuming after photo {checkpoint['last_id']} ({checkpoint['scanned']} scanned, "
+                  f"{checkpoint['updated']} updated so far).")
+        else:
+            checkpoint = dict(last_id=0, scanned=0, updated=0)
+
+        if geocode:
+            # The geocoding rate limiter is per process, so a single worker
+            # keeps the whole run at Nominatim's one request per second
+            workers = 1
+        started = time.time()
+        columns = [Photo.id, Photo.image_filename] + [getattr(Photo, field) for field in METADATA_FIELDS]
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                # Keyset pagination: each batch is an index range scan on the
+                # primary key, however far into the table we are
+                rows = db.session.query(*columns) \
+                    .filter(Photo.id > checkpoint['last_id'], Photo.image_filename.isnot(None)) \
+                    .order_by(Photo.id).limit(batch_size).all()
+                if not rows:
+                    break
+
+                jobs = [(os.path.join(upload_folder, row.image_filename), geocode) for row in rows]
+                values = []
+                for row, metadata in zip(rows, executor.map(extract, jobs, chunksize=8)):
+                    if metadata is None:
+                        print(f"Missing file for photo {row.id}: {row.image_filename}")
+                        continue
+                    changes = changed_fields(row, metadata)
+                    if not changes:
+                        continue
+                    if dry_run:
+                        for field, value in changes.items():
+                            print(f"photo {row.id} ({row.image_filename}) {field}: "
+                                  f"{getattr(row, field)!r} -> {value!r}")
+                    values.append(dict(id=row.id, **changes))
+
+                if values and not dry_run:
+                    # ORM bulk UPDATE by primary key: one executemany per
+                    # distinct set of changed columns instead of a round trip per row
+                    db.session.execute(db.update(Photo), values)
+                    db.session.commit()
+
+                checkpoint['last_id'] = rows[-1].id
+                checkpoint['scanned'] += len(rows)
+                checkpoint['updated'] += len(values)
+                if not dry_run:
+                    save_checkpoint(checkpoint_path, checkpoint)
+                print(f"{checkpoint['scanned']} photos scanned, {checkpoint['updated']} "
+                      f"{'would change' if dry_run else 'updated'} ({time.time() - started:.0f}s)")
+
+        if not dry_run:
+            if checkpoint['updated']:
+                # Bulk UPDATEs bypass the session events that normally do this
+                invalidate_feeds()
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+        print(f"Done: {checkpoint['scanned']} photos scanned, {checkpoint['updated']} "
+              f"{'would change' if dry_run else 'updated'}.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-extract EXIF metadata for every photo.')
+    parser.add_argument('--dry-run', action='store_true', help='print the changes without writing them')
+    parser.add_argument('--restart', action='store_true', help='ignore any saved checkpoint and start over')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=None, help='extraction processes (default: CPU count)')
+    parser.add_argument('--geocode', action='store_true',
+                        help='also re-geocode GPS locations (one request per second, one worker)')
+    args = parser.parse_args()
+    reprocess_metadata(dry_run=args.dry_run, restart=args.restart, batch_size=args.batch_size,
+                       workers=args.workers, geocode=args.geocode)
@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from app import app, db
+from app.models import Post, Photo, Profile
+from app.tiles import tile_version
+
+READ_BLOCK_SIZE = 1024 * 1024
+# Files in UPLOAD_FOLDER that are not uploads
+IGNORED_FILES = {'.gitkeep'}
+# Chunked uploads untouched for this long are treated as abandoned
+STALE_CHUNKED_UPLOAD_AGE = 7 * 24 * 3600
+# Newer files may belong to a save that hasn't been committed yet, so they
+# are never reported as orphans (and neither are in-progress tile builds)
+GRACE_PERIOD = 3600
+
+
+def list_files(root):
+    """Return {relative_path: (size, mtime_ns)} for every file under ``root``."""
+    files = {}
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat()
+                    rel_path = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                    files[rel_path] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_checksums(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_checksums(path, checksums):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(checksums, f, indent=0, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def referenced_filenames():
+    # One column query per model instead of loading rows
+    referenced = set()
+    for column in (Post.image_filename, Photo.image_filename, Profile.image_filename):
+        referenced.update(name for (name,) in db.session.query(column).filter(column.isnot(None)) if name)
+    return referenced
+
+
+def stale_tile_dirs(tiles_folder, upload_folder, photo_filenames):
+    """Tile pyramids whose photo is gone, old versions, and abandoned builds."""
+    stale = []
+    if not os.path.isdir(tiles_folder):
+        return stale
+    for name in os.listdir(tiles_folder):
+        photo_dir = os.path.join(tiles_folder, name)
+        original = os.path.join(upload_folder, name)
+        if name not in photo_filenames or not os.path.exists(original):
+            stale.append(photo_dir)
+            continue
+        current = tile_version(original)
+        cutoff = time.time() - GRACE_PERIOD
+        for version in os.listdir(photo_dir):
+            path = os.path.join(photo_dir, version)
+            if version.startswith('.') and os.path.getmtime(path) > cutoff:
+                continue
+            if version != current:
+                stale.append(path)
+    return stale
+
+
+def stale_chunked_uploads(chunked_folder, max_age):
+    stale = []
+    if not os.path.isdir(chunked_folder):
+        return stale
+    cutoff = time.time() - max_age
+    for name in os.listdir(chunked_folder):
+        path = os.path.join(chunked_folder, name)
+        if os.path.getmtime(path) < cutoff:
+            stale.append(path)
+    return stale
+
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def scan_uploads(delete=False, verify=False, workers=None):
+    with app.app_context():
+        upload_folder = app.config['UPLOAD_FOLDER']
+        checksum_path = os.path.join(app.instance_path, 'upload_checksums.json')
+        started = time.time()
+
+        files = list_files(upload_folder)
+        for name in IGNORED_FILES:
+            files.pop(name, None)
+        referenced = referenced_filenames()
+        photo_filenames = {name for (name,) in db.session.query(Photo.image_filename) if name}
+
+        on_disk = set(files)
+        cutoff_ns = int((time.time() - GRACE_PERIOD) * 1e9)
+        orphans = sorted(p for p in on_disk - referenced if files[p][1] < cutoff_ns)
+        missing = sorted(referenced - on_disk)
+
+        # Only files that are new or whose size/mtime changed are re-hashed,
+        # unless --verify asks to check every stored checksum
+        checksums = load_checksums(checksum_path)
+        to_hash = [
+            rel_path for rel_path, (size, mtime_ns) in files.items()
+            if verify or rel_path not in checksums
+            or checksums[rel_path]['size'] != size or checksums[rel_path]['mtime_ns'] != mtime_ns
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            digests = executor.map(lambda p: sha256_file(os.path.join(upload_folder, p)), to_hash)
+            corrupted = []
+            for rel_path, digest in zip(to_hash, digests):
+                size, mtime_ns = files[rel_path]
+                previous = checksums.get(rel_path)
+                if (verify and previous and previous['sha256'] != digest
+                        and previous['size'] == size and previous['mtime_ns'] == mtime_ns):
+                    corrupted.append(rel_path)
+                checksums[rel_path] = dict(size=size, mtime_ns=mtime_ns, sha256=digest)
+        for rel_path in set(checksums) - on_disk:
+            del checksums[rel_path]
+
+        stale = stale_tile_dirs(app.config['TILES_FOLDER'], upload_folder, photo_filenames)
+        stale += stale_chunked_uploads(app.config['CHUNKED_UPLOAD_FOLDER'], STALE_CHUNKED_UPLOAD_AGE)
+
+        print(f"Scanned {len(files)} files ({len(to_hash)} hashed) against {len(referenced)} references "
+              f"in {time.time() - started:.1f}s.")
+        for rel_path in missing:
+            print(f"Missing: {rel_path}")
+        for rel_path in corrupted:
+            print(f"Checksum changed: {rel_path}")
+        for rel_path in orphans:
+            print(f"Orphan: {rel_path}")
+        for path in stale:
+            print(f"Stale derivative: {os.path.relpath(path, app.instance_path)}")
+        print(f"{len(missing)} missing, {len(corrupted)} corrupted, {len(orphans)} orphans, "
+              f"{len(stale)} stale derivatives.")
+
+        if delete:
+            for rel_path in orphans:
+                remove_path(os.path.join(upload_folder, rel_path))
+                checksums.pop(rel_path, None)
+            for path in stale:
+                remove_path(path)
+            print(f"Removed {len(orphans)} orphans and {len(stale)} stale derivatives.")
+        elif orphans or stale:
+            print("Run with --delete to remove them.")
+
+        save_checksums(checksum_path, checksums)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check UPLOAD_FOLDER against the database.')
+    parser.add_argument('--delete', action='store_true', help='remove orphaned uploads and stale derivatives')
+    parser.add_argument('--verify', action='store_true', help='re-hash every file and report checksum changes')
+    parser.add_argument('--workers', type=int, default=None, help='hashing threads (default: CPU count + 4)')
+    args = parser.parse_args()
+    scan_uploads(delete=args.delete, verify=args.verify, workers=args.workers)
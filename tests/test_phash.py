@@ -0,0 +1,54 @@
+import io
+import os
+import tempfile
+
+# The app reads DATABASE_URL when it is imported
+_tmp = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp, 'test.db')
+
+from PIL import Image, ImageDraw
+from flask import get_flashed_messages
+from app import app, db
+from app.models import Post, Photo
+from app.phash import get_photo_index
+from app.routes import PostView, admin
+
+
+def _save_image(filename, vertical):
+    image = Image.new('RGB', (400, 300), 'white')
+    draw = ImageDraw.Draw(image)
+    for i in range(0, 400, 30):
+        draw.rectangle([i, 0, i + 10, 300] if vertical else [0, i, 400, i + 10 + i // 10], fill='black')
+    image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename), 'JPEG')
+
+
+def test_identical_photos_in_one_save_are_flagged():
+    app.config.update(TESTING=True, TILES_ENABLED=False,
+                      UPLOAD_FOLDER=os.path.join(_tmp, 'uploads'),
+                      FEED_CACHE_FOLDER=os.path.join(_tmp, 'feeds'))
+    os.makedirs(app.config['UPLOAD_FOLDER'])
+    view = next(v for v in admin._views if isinstance(v, PostView))
+
+    with app.app_context():
+        db.create_all()
+        # An earlier save loads this worker's index
+        _save_image('other.jpg', vertical=False)
+        earlier = Post(title='Earlier')
+        db.session.add_all([earlier, Photo(image_filename='other.jpg', post=earlier)])
+        db.session.commit()
+        with app.test_request_context():
+            view.after_model_change(None, earlier, True)
+        assert get_photo_index().index is not None
+
+        for filename in ('a.jpg', 'b.jpg'):
+            _save_image(filename, vertical=True)
+        post = Post(title='Shoot')
+        db.session.add_all([post, Photo(image_filename='a.jpg', post=post),
+                            Photo(image_filename='b.jpg', post=post)])
+        db.session.commit()
+        with app.test_request_context():
+            view.after_model_change(None, post, True)
+            warnings = get_flashed_messages(category_filter=['warning'])
+
+        assert [w for w in warnings if "'b.jpg' looks like a near-duplicate of 'a.jpg'" in w]
+        assert not [w for w in warnings if 'other.jpg' in w]